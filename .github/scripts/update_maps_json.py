@@ -2,73 +2,222 @@
 """
 Regenerate maps.json from campaigns/<Campaign>/ structure.
 
+    update_maps_json.py [--mode {update,regen}]
+
+update (default) reuses known digests; regen re-hashes every file.
+With TRUST_FILENAME_HASH=1, update also takes a 64-hex SHA-256 embedded
+in a file name (e.g. MyMap.<sha256>.SC2Map) as that file's digest.
+
 • New files (map or mod) start at version 1.0
 • On SHA-256 change → bump minor (1.0 → 1.1 → 1.2)
+• Files git reports unchanged since the last CI manifest commit, or whose
+  size + mtime match .hashcache.json, are not re-hashed
 • Removes deleted entries *except* ones flagged "release_asset": true
 • ‘launcher’ map always listed first
+• Hidden (dot-prefixed) folders and files are ignored
 • Campaign minor version bumps if any entry changed
 """
 
-import hashlib, json, os, re, subprocess
+import argparse, functools, hashlib, json, mmap, os, re, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from urllib.parse import quote
 from pathlib import Path
 
+try:                                    # optional C codec, same output
+    import orjson
+    loads = orjson.loads
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    loads = json.loads                  # accepts bytes, no decode step
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, indent=2, separators=(",", ": "),
+                          ensure_ascii=False).encode()
+
 # ------------------------------------------------------------
 ROOT      = Path(__file__).resolve().parents[2]
 MAPS_DIR  = ROOT / "campaigns"
 MAPS_JSON = ROOT / "maps.json"
+HASH_CACHE = ROOT / ".hashcache.json"     # git-ignored: path → stat + digest
 
 # -------- derive owner/repo for raw URLs --------------------
-owner_repo = os.getenv("GITHUB_REPOSITORY")
-if not owner_repo or "/" not in owner_repo:
-    try:
-        url = subprocess.check_output(
-            ["git", "config", "--get", "remote.origin.url"], text=True
-        ).strip()
-        m = re.search(r"[/:]([^/]+)/([^/]+?)(?:\.git)?$", url)
-        if m:
-            owner_repo = f"{m.group(1)}/{m.group(2)}"
-    except Exception:
-        pass
-if not owner_repo or "/" not in owner_repo:
-    raise SystemExit("Unable to determine <owner>/<repo>")
-
-RAW_BASE = f"https://raw.githubusercontent.com/{owner_repo}/main/"
+def raw_base() -> str:
+    owner_repo = os.getenv("GITHUB_REPOSITORY")
+    if not owner_repo or "/" not in owner_repo:
+        try:
+            url = subprocess.check_output(
+                ["git", "config", "--get", "remote.origin.url"], text=True
+            ).strip()
+            m = re.search(r"[/:]([^/]+)/([^/]+?)(?:\.git)?$", url)
+            if m:
+                owner_repo = f"{m.group(1)}/{m.group(2)}"
+        except Exception:
+            pass
+    if not owner_repo or "/" not in owner_repo:
+        raise SystemExit("Unable to determine <owner>/<repo>")
+    return f"https://raw.githubusercontent.com/{owner_repo}/main/"
 
 # -------- version helpers (major.minor) ---------------------
-VER_RE = re.compile(r"^(?P<maj>\d+)\.(?P<min>\d+)$")
+# versions are only ever written by this script → plain split, no regex;
+# the same few strings ("1.0", "1.1", …) recur, so results are memoized
+@functools.lru_cache(maxsize=None)
 def bump_minor(ver: str) -> str:
-    m = VER_RE.match(ver or "1.0") or VER_RE.match("1.0")
-    maj, minor = map(int, m.groups())
-    return f"{maj}.{minor+1}"
-
-def sha256(p: Path) -> str:
-    h = hashlib.sha256()
-    with p.open("rb", buffering=0) as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-# -------- load current manifest -----------------------------------
-current = {c["title"]: c for c in json.loads(MAPS_JSON.read_text())} \
-          if MAPS_JSON.exists() else {}
-new_manifest = []
-
-# -------- iterate campaigns ---------------------------------------
-for camp_dir in sorted(p for p in MAPS_DIR.iterdir() if p.is_dir()):
-    title      = camp_dir.name
-    asset_png  = f"{title}.png"
-    old_block  = current.get(title, {})
-    old_maps   = {m["name"]: m for m in old_block.get("maps", [])}
-    camp_ver   = old_block.get("version", "1.0")
-
-    updated_paths = []
-
-    # --- collect *.SC2Map files in campaign root ------------------
-    updated_paths += list(camp_dir.glob("*.SC2Map"))
-
-    # --- collect *.SC2Mod files under mods/ -----------------------
-    updated_paths += list((camp_dir / "mods").glob("*.SC2Mod"))
+    try:
+        maj, minor = str(ver or "1.0").split(".")   # str(): hand-typed 1.2
+        return f"{int(maj)}.{int(minor)+1}"
+    except ValueError:                           # malformed → treat as 1.0
+        return "1.1"
+
+# -------- ordering: launcher first, then case-insensitive name ---
+def sort_key(name: str) -> tuple:
+    folded = name.casefold()
+    return (0 if "launcher" in folded else 1, folded)
+
+# -------- campaign scan: *.SC2Map in root + mods/*.SC2Mod ---------
+# one scandir pass over the campaign folder (DirEntry caches type + stat);
+# returns [(sort_key, DirEntry, rel)] already in manifest order, where
+# rel is the repo-relative POSIX path (hash-cache key + raw-URL suffix),
+# built from known names rather than via Path.relative_to().
+# Dot-entries are skipped (e.g. macOS "._Name.SC2Map" resource forks).
+def collect(camp_dir: Path) -> list:
+    prefix = f"{MAPS_DIR.name}/{camp_dir.name}/"
+    keyed  = []
+    with os.scandir(camp_dir) as it:
+        for e in it:
+            if e.name.startswith("."):
+                continue
+            if e.name.endswith(".SC2Map") and e.is_file():
+                keyed.append((sort_key(e.name), e, prefix + e.name))
+            elif e.name == "mods" and e.is_dir():
+                with os.scandir(e.path) as mods:
+                    keyed += [(sort_key(m.name), m, f"{prefix}mods/{m.name}")
+                              for m in mods
+                              if m.name.endswith(".SC2Mod") and
+                              not m.name.startswith(".") and m.is_file()]
+    keyed.sort(key=itemgetter(0))
+    return keyed
+
+# Digest written to each entry's "sha256" field. Clients verify downloads
+# against it, so it has to stay SHA-256 even though it is also our
+# change-detection key.
+HASH_NAME = "sha256"
+# fresh contexts are cloned from this one instead of re-resolving the
+# algorithm and initialising a new EVP context for every file
+_TEMPLATE = hashlib.new(HASH_NAME)
+_file_digest = getattr(hashlib, "file_digest", None)     # Python 3.11+
+
+# below this, mapping + page-faulting costs more than file_digest's reads
+MMAP_MIN_SIZE = 4 << 20
+
+def sha256(p, size: int) -> str:
+    with open(p, "rb", buffering=0) as f:
+        # large file: map it → one update() call straight from page cache
+        if size >= MMAP_MIN_SIZE:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    h = _TEMPLATE.copy()
+                    h.update(mm)
+                    return h.hexdigest()
+            except (ValueError, OSError):            # unmappable → stream
+                pass
+        if _file_digest:                             # C read/update loop
+            return _file_digest(f, _TEMPLATE.copy).hexdigest()
+        # older Pythons: refill one preallocated buffer instead of
+        # allocating a fresh bytes object per chunk
+        h   = _TEMPLATE.copy()
+        buf = bytearray(1 << 20)
+        mv  = memoryview(buf)
+        while n := f.readinto(buf):
+            h.update(mv[:n])
+        return h.hexdigest()
+
+# -------- git: digests vouched for by the last CI manifest ---------
+# Base is the last maps.json commit made by the workflow below: its
+# manifest was generated from exactly that tree. Returns
+# {rel path: base digest} for tracked files under campaigns/ that don't
+# differ from the base, or None when git can't tell (no git, shallow
+# clone) → hash as usual. Untracked and ignored files are never listed.
+# maps.json itself may have moved on since (e.g. a developer committed a
+# locally regenerated manifest); callers compare against these digests.
+CI_COMMIT_MSG    = "ci: update maps.json with release URLs"
+CI_COMMIT_AUTHOR = "github-actions"
+
+def git_base_digests():
+    def git(*args) -> str:
+        return subprocess.check_output(["git", *args], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL)
+    try:
+        # whole-line match by the workflow's author, so e.g. a
+        # 'Revert "ci: update maps.json …"' commit never becomes the base
+        subject = "^" + CI_COMMIT_MSG.replace(".", r"\.") + "$"
+        base = git("log", "-1", "--format=%H", f"--grep={subject}",
+                   f"--author={CI_COMMIT_AUTHOR}", "--", "maps.json").strip()
+        if not base:
+            return None
+        diff = git("diff", "--name-only", "--no-renames", "-z", base,
+                   "--", "campaigns")
+        tracked = git("ls-files", "-z", "--", "campaigns")
+        base_manifest = loads(git("show", f"{base}:maps.json"))
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+    by_name = {(c["title"], m["name"]): m.get("sha256")
+               for c in base_manifest for m in c.get("maps", [])}
+    digests = {}
+    for rel in set(tracked.split("\0")) - set(diff.split("\0")) - {""}:
+        # campaigns/<title>/<name> or campaigns/<title>/mods/<name>
+        parts = rel.split("/")
+        if digest := by_name.get((parts[1], parts[-1])):
+            digests[rel] = digest
+    return digests
+
+# -------- digest embedded in the file name (opt-in) ----------------
+HASH_IN_NAME = re.compile(r"(?<![0-9a-fA-F])([0-9a-f]{64})(?![0-9a-fA-F])")
+
+# -------- per campaign, pass 1: scan + queue hashing --------------
+def queue_hashes(camp_dir: Path, old_maps: dict, pool: ThreadPoolExecutor,
+                 cache: dict, git_digests, trust_names: bool,
+                 trust_cache: bool) -> tuple:
+    keyed   = collect(camp_dir)              # *.SC2Map + mods/*.SC2Mod
+    known   = {}                             # name → digest, no hashing
+    futures = {}                             # name → pending digest
+    for _, path, rel in keyed:
+        old = old_maps.get(path.name, {}).get("sha256")
+
+        # publisher put the digest in the name → no need to read the file
+        if trust_names and (m := HASH_IN_NAME.search(path.name)):
+            known[path.name] = m.group(1)
+            continue
+
+        # tracked + untouched since the CI manifest, and our entry still
+        # carries that manifest's digest → reuse it without reading
+        if old and git_digests and git_digests.get(rel) == old:
+            known[path.name] = old
+            continue
+
+        st  = path.stat()                    # cached on the DirEntry
+        hit = cache.get(rel) if trust_cache else None
+        if not isinstance(hit, dict):        # missing or hand-mangled entry
+            hit = {}
+
+        # size + mtime unchanged → trust the cached digest
+        if (hit.get("size") == st.st_size and
+                hit.get("mtime_ns") == st.st_mtime_ns and
+                isinstance(hit.get("digest"), str)):
+            known[path.name] = hit["digest"]
+        else:
+            futures[path.name] = pool.submit(sha256, path, st.st_size)
+    return keyed, known, futures
+
+# -------- per campaign, pass 2: build the manifest block ----------
+def build_campaign(camp_dir: Path, old_block: dict, old_maps: dict,
+                   keyed: list, known: dict, futures: dict,
+                   cache: dict, base_url: str) -> dict:
+    title    = camp_dir.name
+    camp_ver = old_block.get("version", "1.0")
+    # entries below are updated in place → snapshot digests for the diff
+    old_digests = {n: m.get("sha256") for n, m in old_maps.items()}
 
     # --- remember release-asset entries whose file is gone --------
     keep_release = {
@@ -76,47 +225,132 @@ for camp_dir in sorted(p for p in MAPS_DIR.iterdir() if p.is_dir()):
     }
 
     # --- build / update entries ----------------------------------
-    new_entries = []
-    for path in sorted(updated_paths, key=lambda p: p.name.lower()):
+    decorated = []                       # (sort key, entry)
+    for key, path, rel in keyed:
         name   = path.name
-        digest = sha256(path)
         entry  = old_maps.get(name,
                  {"version": "1.0", "sha256": "", "name": name})
 
-        if entry["sha256"] != digest:
-            entry["version"] = bump_minor(entry["version"])
+        if name in futures:
+            digest = futures[name].result()
+            st     = path.stat()
+            cache[rel] = {"mtime_ns": st.st_mtime_ns,
+                          "size":     st.st_size,
+                          "digest":   digest}
+        else:
+            digest = known[name]
+
+        if entry.get("sha256") != digest:
+            entry["version"] = bump_minor(entry.get("version"))
             entry["sha256"]  = digest
 
-        rel = quote(path.relative_to(ROOT).as_posix())
-        entry["url"] = RAW_BASE + rel
-        new_entries.append(entry)
+        # unchanged file with a raw URL on the same base → keep it as is
+        if name in futures or not entry.get("url", "").startswith(base_url):
+            entry["url"] = base_url + quote(rel)
+        decorated.append((key, entry))
 
     # --- resurrect release-asset entries not on disk --------------
-    existing_names = {e["name"] for e in new_entries}
+    existing_names = {e["name"] for _, e in decorated}
     for name, entry in keep_release.items():
         if name not in existing_names:
-            new_entries.append(entry)
+            decorated.append((sort_key(name), entry))
 
     # ----- launcher first -----------------------------------------
-    new_entries.sort(key=lambda m: (0 if "launcher" in m["name"].lower() else 1,
-                                    m["name"].lower()))
+    decorated.sort(key=itemgetter(0))
+    new_entries = [e for _, e in decorated]
 
     # ----- bump campaign version if something changed -------------
-    old_sorted = sorted(old_maps.values(), key=lambda m: m["name"])
-    if (
-        len(new_entries) != len(old_sorted) or
-        any(a["sha256"] != b["sha256"] or a["version"] != b["version"]
-            for a, b in zip(sorted(new_entries, key=lambda m: m["name"]), old_sorted))
-    ):
+    new_by_name = {e["name"]: e for e in new_entries}
+    changed = {n for n, e in new_by_name.items()
+               if old_digests.get(n) != e.get("sha256")}
+    added   = new_by_name.keys() - old_digests.keys()
+    removed = old_digests.keys() - new_by_name.keys()
+    if changed or added or removed:
         camp_ver = bump_minor(camp_ver)
 
-    new_manifest.append({
+    return {
         "title":   title,
         "version": camp_ver,
-        "asset":   asset_png,
+        "asset":   f"{title}.png",
         "maps":    new_entries
-    })
+    }
+
+# -------- one run: scan, hash what changed, write maps.json ------
+# full=True ignores the git / stat-cache shortcuts and re-hashes every
+# file; the cache is still loaded so entries for files not on disk
+# survive. Returns True when maps.json was rewritten.
+def regenerate(full: bool = False) -> bool:
+    base_url = raw_base()
+
+    # --- load current manifest + hash cache -----------------------
+    # title → (campaign block, {entry name → entry}), indexed once here
+    current = {c["title"]: (c, {m["name"]: m for m in c.get("maps", [])})
+               for c in loads(MAPS_JSON.read_bytes())} \
+              if MAPS_JSON.exists() else {}
+
+    cache = {}
+    if HASH_CACHE.exists():
+        try:
+            cache = loads(HASH_CACHE.read_bytes())
+        except ValueError:              # corrupt cache → just rehash
+            pass
+        if not isinstance(cache, dict): # valid JSON, wrong shape → same
+            cache = {}
+    cache_before  = dumps(cache)
+    git_digests   = None if full else git_base_digests()
+    trust_names   = not full and os.getenv("TRUST_FILENAME_HASH") == "1"
+
+    with os.scandir(MAPS_DIR) as it:
+        camp_names = sorted(e.name for e in it
+                            if not e.name.startswith(".") and e.is_dir())
+
+    # hashlib releases the GIL while hashing, so threads hash files in
+    # parallel. No ProcessPoolExecutor: it would only add worker start-up
+    # and pickling, and under "spawn" every worker re-imports this module.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        # --- iterate campaigns ------------------------------------
+        # queue every campaign's hashing before assembling any block, so
+        # the pool works across campaign boundaries instead of draining
+        # per folder
+        campaigns = []
+        for camp_dir in (MAPS_DIR / n for n in camp_names):
+            old_block, old_maps = current.get(camp_dir.name, ({}, {}))
+            campaigns.append((camp_dir, old_block, old_maps,
+                              *queue_hashes(camp_dir, old_maps, pool, cache,
+                                            git_digests, trust_names,
+                                            trust_cache=not full)))
+
+        new_manifest = [build_campaign(*c, cache, base_url)
+                        for c in campaigns]
+
+    # --- persist hash cache (entries for missing files are kept) --
+    cache_bytes = dumps(cache)
+    if cache_bytes != cache_before:
+        HASH_CACHE.write_bytes(cache_bytes)
+
+    # --- write manifest -------------------------------------------
+    # identical bytes → leave the file (and its mtime / git status) alone
+    new_bytes = dumps(new_manifest)
+    old_bytes = MAPS_JSON.read_bytes() if MAPS_JSON.exists() else b""
+    if new_bytes == old_bytes:
+        print("✅ maps.json unchanged")
+        return False
+    MAPS_JSON.write_bytes(new_bytes)
+    print("✅ maps.json regenerated (keeps release assets)")
+    return True
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Regenerate maps.json.")
+    ap.add_argument("--mode", choices=("update", "regen"), default="update",
+                    help="update: reuse digests git / .hashcache.json vouch "
+                         "for (default); regen: re-hash every file")
+    args = ap.parse_args(argv)
+    changed = regenerate(full=args.mode == "regen")
+
+    # in Actions: expose the result so the commit step can be skipped
+    if out := os.getenv("GITHUB_OUTPUT"):
+        with open(out, "a") as f:
+            f.write(f"changed={str(changed).lower()}\n")
 
-# -------- write manifest ------------------------------------------
-MAPS_JSON.write_text(json.dumps(new_manifest, indent=2))
-print("✅ maps.json regenerated (keeps release assets)")
\ No newline at end of file
+if __name__ == "__main__":
+    main()